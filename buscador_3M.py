@@ -1,8 +1,16 @@
 import streamlit as st
 import pandas as pd
-import io
-from barcode import Code128  # Cambiado de EAN13 a Code128
-from barcode.writer import ImageWriter
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import requests
+import html
+import os
+import tempfile
+import time
+from collections import namedtuple
+from itertools import groupby
 from PIL import Image  # Importamos la librería para manejar imágenes
 
 # --- Configuración de la Página ---
@@ -12,7 +20,19 @@ st.set_page_config(
     layout="wide",
 )
 
+
 # --- Encabezado con Logo ---
+@st.cache_resource
+def load_logo():
+    """Carga el logo una sola vez por proceso; devuelve None si no existe el archivo."""
+    try:
+        logo = Image.open('logo.png')
+        logo.load()  # Image.open es perezoso: forzamos la decodificación aquí
+        return logo
+    except FileNotFoundError:
+        return None
+
+
 # Creamos dos columnas para poner el título a la izquierda y el logo a la derecha
 # La primera columna es 3 veces más ancha que la segunda
 col1, col2 = st.columns([3, 1])
@@ -24,10 +44,10 @@ with col1:
 
 with col2:
     # Intentamos cargar y mostrar el logo
-    try:
-        logo = Image.open('logo.png')
+    logo = load_logo()
+    if logo is not None:
         st.image(logo, width=200)  # Ajusta el 'width' según el tamaño deseado
-    except FileNotFoundError:
+    else:
         st.warning("No se encontró el archivo 'logo.png' en la carpeta raíz.")
 
 st.markdown("---")
@@ -43,28 +63,178 @@ selected_location = st.selectbox(
 )
 selected_gid = locations[selected_location]
 
+# Columnas que se leen de la hoja y su tipo
+COLUMN_TYPES = {
+    "Folio Rebuss": pa.string(),
+    "ABASSU": pa.string(),
+    "ABDESC": pa.string(),
+    "ABSER#": pa.string(),
+    "PLDESC": pa.string(),
+}
+COLUMNS_TO_USE = list(COLUMN_TYPES)
+
+# Cantidad de resultados que se muestran por página
+PAGE_SIZE = 20
+# Largo mínimo de la consulta para filtrar (evita listar casi toda la hoja con una sola letra)
+MIN_QUERY_LENGTH = 2
+
 
 # --- Función para Generar Código de Barras ---
+# Anchos (barra, espacio, barra, ...) en módulos de los 106 símbolos Code128;
+# los índices 103, 104 y 105 son los inicios A, B y C.
+CODE128_PATTERNS = (
+    "212222", "222122", "222221", "121223", "121322", "131222", "122213", "122312",
+    "132212", "221213", "221312", "231212", "112232", "122132", "122231", "113222",
+    "123122", "123221", "223211", "221132", "221231", "213212", "223112", "312131",
+    "311222", "321122", "321221", "312212", "322112", "322211", "212123", "212321",
+    "232121", "111323", "131123", "131321", "112313", "132113", "132311", "211313",
+    "231113", "231311", "112133", "112331", "132131", "113123", "113321", "133121",
+    "313121", "211331", "231131", "213113", "213311", "213131", "311123", "311321",
+    "331121", "312113", "312311", "332111", "314111", "221411", "431111", "111224",
+    "111422", "121124", "121421", "141122", "141221", "112214", "112412", "122114",
+    "122411", "142112", "142211", "241211", "221114", "413111", "241112", "134111",
+    "111242", "121142", "121241", "114212", "124112", "124211", "411212", "421112",
+    "421211", "212141", "214121", "412121", "111143", "111341", "131141", "114113",
+    "114311", "411113", "411311", "113141", "114131", "311141", "411131", "211412",
+    "211214", "211232",
+)
+CODE128_STOP = "2331112"
+CODE128_START_B, CODE128_START_C = 104, 105
+CODE128_CODE_B, CODE128_CODE_C = 100, 99
+
+# Tamaños del dibujo, en módulos
+BARCODE_QUIET_ZONE = 10
+BARCODE_BAR_HEIGHT = 60
+BARCODE_TEXT_HEIGHT = 22
+
+
+def code128_values(code):
+    """Convierte un texto en la lista de valores Code128 (inicio, datos y dígito de control)."""
+    if not code or any(not 32 <= ord(char) <= 126 for char in code):
+        raise ValueError("Code128 solo admite caracteres ASCII imprimibles")
+    # Partimos el texto en tramos (set, texto). Los tramos de dígitos van en el
+    # set C (dos dígitos por símbolo) cuando eso ahorra símbolos: desde 2 dígitos
+    # si es todo el texto, 4 al inicio o al final, y 6 en el medio.
+    segments = []
+    pos = 0
+    for is_digit, group in groupby(code, key=lambda char: '0' <= char <= '9'):
+        run = "".join(group)
+        at_start, at_end = pos == 0, pos + len(run) == len(code)
+        pos += len(run)
+        min_digits = 2 if at_start and at_end else 4 if at_start or at_end else 6
+        if not is_digit or len(run) < min_digits:
+            segments.append(('B', run))
+        elif len(run) % 2 == 0:
+            segments.append(('C', run))
+        elif at_start:
+            # El dígito sobrante se codifica en el set B, junto al texto que sigue
+            segments += [('C', run[:-1]), ('B', run[-1])]
+        else:
+            segments += [('B', run[0]), ('C', run[1:])]
+    values = []
+    charset = None
+    for segment_charset, text in segments:
+        if segment_charset != charset:
+            if charset is None:
+                values.append(CODE128_START_C if segment_charset == 'C' else CODE128_START_B)
+            else:
+                values.append(CODE128_CODE_C if segment_charset == 'C' else CODE128_CODE_B)
+            charset = segment_charset
+        if charset == 'C':
+            values += [int(text[i:i + 2]) for i in range(0, len(text), 2)]
+        else:
+            values += [ord(char) - 32 for char in text]
+    checksum = (values[0] + sum(i * value for i, value in enumerate(values[1:], 1))) % 103
+    return values + [checksum]
+
+
+# Se cachea por folio para no volver a dibujar el mismo código en cada recarga
+@st.cache_data(max_entries=2048)
 def generate_barcode(folio):
-    """Genera un código de barras Code128 a partir de un folio y lo devuelve como una imagen en memoria."""
+    """Genera un código de barras Code128 a partir de un folio y lo devuelve como texto SVG."""
     try:
         # Usamos el folio directamente como un string, sin rellenar con ceros.
         code = str(folio)
 
-        # Generar el código de barras en un buffer de memoria para no crear archivos
-        buffer = io.BytesIO()
-        # Se cambia EAN13 por Code128. Se añaden opciones para que el texto sea visible.
-        barcode_img = Code128(code, writer=ImageWriter())
-        barcode_img.write(
-            buffer, options={'write_text': True, 'font_size': 10, 'module_height': 12.0})
-        return buffer
+        # Codificamos a mano el patrón de barras y lo dibujamos como un único
+        # 'path' SVG, sin pasar por python-barcode ni por PIL.
+        widths = "".join(CODE128_PATTERNS[value] for value in code128_values(code))
+        widths += CODE128_STOP
+        bars = []
+        x = BARCODE_QUIET_ZONE
+        for i, width in enumerate(widths):
+            width = int(width)
+            if i % 2 == 0:
+                bars.append(f"M{x},0h{width}v{BARCODE_BAR_HEIGHT}h-{width}z")
+            x += width
+        total_width = x + BARCODE_QUIET_ZONE
+        total_height = BARCODE_BAR_HEIGHT + BARCODE_TEXT_HEIGHT
+        # Se añade el texto del folio debajo de las barras para que sea visible.
+        # El ancho es relativo y el alto sale del 'viewBox', para que el código
+        # ocupe toda la columna como antes con use_container_width=True.
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="100%" '
+            f'viewBox="0 0 {total_width} {total_height}">'
+            f'<rect width="100%" height="100%" fill="white"/>'
+            f'<path d="{"".join(bars)}" fill="black"/>'
+            f'<text x="{total_width / 2}" y="{total_height - 4}" font-size="18" '
+            f'font-family="monospace" text-anchor="middle">{html.escape(code)}</text>'
+            f'</svg>'
+        )
     except Exception as e:
         # Imprime el error en la consola de streamlit para depuración
         print(f"Error generando barcode para folio '{folio}': {e}")
         # Devuelve None si el folio no es válido para un código de barras (ej. contiene letras)
         return None
 
+
+def show_barcode(folio):
+    """Marca en la sesión que se debe mostrar el código de barras del folio."""
+    st.session_state[f'open_{folio}'] = True
+
+
 # --- Carga de Datos con Caché ---
+# Copia local en Parquet de cada hoja descargada, válida durante CACHE_TTL segundos
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "3m")
+CACHE_TTL = 15 * 60
+
+SheetContent = namedtuple("SheetContent", ["body", "etag"])
+
+
+def csv_records_offset(body, records):
+    """Devuelve la posición en bytes donde termina el registro número 'records' del CSV.
+
+    Los saltos de línea dentro de un campo entre comillas no cuentan como fin de registro.
+    """
+    in_quotes = False
+    for i, byte in enumerate(body):
+        if records == 0:
+            return i
+        if byte == 0x22:  # '"' (las comillas dobles escapadas "" se anulan entre sí)
+            in_quotes = not in_quotes
+        elif byte == 0x0A and not in_quotes:  # '\n'
+            records -= 1
+    return len(body)
+
+
+def download_sheet(sheet_url, etag_path=None):
+    """Descarga el CSV de la hoja (comprimido con gzip en tránsito).
+
+    Si 'etag_path' apunta a un ETag guardado, la petición es condicional y se
+    devuelve None cuando la hoja no cambió; si no, devuelve un SheetContent.
+    """
+    headers = {'Accept-Encoding': 'gzip'}
+    if etag_path and os.path.exists(etag_path):
+        with open(etag_path) as f:
+            headers['If-None-Match'] = f.read().strip()
+    response = requests.get(sheet_url, headers=headers, timeout=30)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    # 'requests' ya descomprime el cuerpo
+    return SheetContent(response.content, response.headers.get('ETag'))
+
+
 # Se añade el parámetro 'gid' para cargar la hoja correcta
 
 
@@ -74,18 +244,69 @@ def load_data(gid):
     sheet_id = "1uga-VQ9UTr9lhMPe-VGjA581G2Fyjatt6bNB6JeEykk"
     sheet_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
     try:
-        column_types = {
-            "Folio Rebuss": str,
-            "ABASSU": str,
-            "ABDESC": str,
-            "ABSER#": str,
-            "PLDESC": str,  # Se añade la nueva columna
-        }
-        columns_to_use = ["Folio Rebuss", "ABASSU", "ABDESC",
-                          "ABSER#", "PLDESC"]  # Se añade la nueva columna
-        df = pd.read_csv(sheet_url, usecols=columns_to_use,
-                         dtype=column_types, header=5)
-        df['search_col'] = df['ABDESC'].str.lower().fillna('')
+        cache_path = os.path.join(CACHE_DIR, f"{gid}.parquet")
+        etag_path = os.path.join(CACHE_DIR, f"{gid}.etag")
+        has_cache = os.path.exists(cache_path)
+        content = None
+        if not has_cache or time.time() - os.path.getmtime(cache_path) >= CACHE_TTL:
+            # Copia local vencida o inexistente: consultamos la hoja. Si hay copia,
+            # se envía su ETag; si la hoja no cambió, el servidor responde 304 sin cuerpo.
+            try:
+                content = download_sheet(sheet_url, etag_path if has_cache else None)
+            except requests.RequestException as e:
+                if not has_cache:
+                    raise
+                # Sin conexión, límite de peticiones, etc.: usamos la copia local vencida
+                print(f"No se pudo actualizar la hoja, se usa la copia local '{cache_path}': {e}")
+            else:
+                if content is None:
+                    # Sin cambios: renovamos la vigencia de la copia local
+                    os.utime(cache_path)
+        if content is None:
+            # Copia local vigente: evitamos descargar y parsear el CSV otra vez
+            df = pd.read_parquet(
+                cache_path, columns=COLUMNS_TO_USE + ['search_col'],
+                dtype_backend='pyarrow')
+        else:
+            # El lector de PyArrow parsea el CSV en paralelo y entrega columnas Arrow.
+            # Se usa directamente (y no vía pd.read_csv) para que las columnas se lean
+            # como texto desde el inicio: así no se pierden los ceros a la izquierda
+            # de los folios. Los encabezados están en la fila 6, y las celdas con
+            # varias líneas llegan como campos entre comillas con saltos de línea.
+            # 'skip_rows' de PyArrow cuenta líneas físicas, así que las 5 filas de
+            # título se saltan aparte, respetando las comillas.
+            body = pa.py_buffer(content.body)
+            table = pa_csv.read_csv(
+                pa.BufferReader(body.slice(csv_records_offset(content.body, 5))),
+                parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                convert_options=pa_csv.ConvertOptions(
+                    include_columns=COLUMNS_TO_USE, column_types=COLUMN_TYPES,
+                    strings_can_be_null=True))
+            df = table.to_pandas(types_mapper=pd.ArrowDtype)
+            df['search_col'] = df['ABDESC'].str.lower().fillna('')
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                # Se escribe en un archivo temporal y se reemplaza de una vez, para que
+                # una caída o una sesión concurrente nunca dejen un Parquet a medias.
+                fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.parquet.tmp')
+                os.close(fd)
+                try:
+                    df.to_parquet(tmp_path, compression='zstd')
+                    os.replace(tmp_path, cache_path)
+                except Exception:
+                    os.remove(tmp_path)
+                    raise
+                # El ETag se guarda solo si la copia local quedó escrita
+                if content.etag:
+                    with open(etag_path, 'w') as f:
+                        f.write(content.etag)
+                elif os.path.exists(etag_path):
+                    os.remove(etag_path)
+            except Exception as e:
+                # Si no se puede escribir la copia local, seguimos con los datos en memoria
+                print(f"No se pudo guardar la caché local '{cache_path}': {e}")
+        # Identificador de esta carga, para construir el índice de búsqueda con estos mismos datos
+        df.attrs['load_id'] = time.time_ns()
         return df
     except Exception as e:
         st.error(
@@ -94,6 +315,56 @@ def load_data(gid):
         return pd.DataFrame()
 
 
+# --- Índice de Búsqueda ---
+# Arreglos de búsqueda de una hoja. Se guardan aparte del DataFrame (y no en
+# df.attrs) porque pandas copia 'attrs' en cada DataFrame derivado. Se cachean
+# por GID y por 'load_id', así cada nueva carga de load_data tiene su propio índice.
+SearchIndex = namedtuple(
+    "SearchIndex", ["rows", "descriptions", "vocab", "codes", "postings"])
+
+
+@st.cache_resource(max_entries=2 * len(locations))
+def build_search_index(gid, load_id, _df):
+    """Construye los arreglos de búsqueda sobre 'search_col' del DataFrame cargado."""
+    df = _df
+    # Copia de 'search_col' como arreglo Arrow con codificación de diccionario:
+    # cada descripción distinta se guarda una sola vez, así el filtro
+    # solo recorre los textos únicos y luego expande el resultado por índice.
+    search_arrow = pa.array(
+        df['search_col'].to_numpy(), type=pa.string()).dictionary_encode()
+    # Índice invertido: palabra -> posiciones de las descripciones únicas que la contienen.
+    # Se arma con funciones de Arrow/NumPy en lugar de recorrer los textos en Python:
+    # cada par (palabra, descripción) queda como codes[i] -> postings[i].
+    tokens = pc.utf8_split_whitespace(search_arrow.dictionary)
+    words = pc.list_flatten(tokens)
+    parents = pc.list_parent_indices(tokens).to_numpy()
+    not_empty = pc.not_equal(words, '')
+    words = words.filter(not_empty).dictionary_encode()
+    parents = parents[not_empty.to_numpy(zero_copy_only=False)]
+    codes = words.indices.to_numpy()
+    order = np.lexsort((parents, codes))
+    codes, parents = codes[order], parents[order]
+    # Una descripción puede repetir una palabra: nos quedamos con un par por palabra
+    keep = np.ones(len(codes), dtype=bool)
+    keep[1:] = (codes[1:] != codes[:-1]) | (parents[1:] != parents[:-1])
+    codes, parents = codes[keep], parents[keep]
+    return SearchIndex(
+        rows=search_arrow.indices.to_numpy(),
+        descriptions=search_arrow.dictionary,
+        vocab=words.dictionary,
+        codes=codes,
+        postings=parents.astype(np.int32))
+
+
+def keyword_candidates(index, keyword):
+    """Devuelve, ordenadas, las posiciones de las descripciones únicas que contienen la palabra clave."""
+    # Las palabras clave no tienen espacios, así que cualquier coincidencia cae
+    # dentro de una sola palabra del vocabulario: basta con unir sus listas.
+    token_mask = pc.match_substring(
+        index.vocab, keyword).to_numpy(zero_copy_only=False)
+    return np.unique(index.postings[token_mask[index.codes]])
+
+
 # Cargamos los datos pasando el GID seleccionado
 df = load_data(selected_gid)
 
@@ -106,47 +377,77 @@ if not df.empty:
     )
 
     # --- Lógica de Búsqueda y Visualización ---
-    if search_query:
+    if len(search_query.strip()) >= MIN_QUERY_LENGTH:
         keywords = search_query.lower().split()
-        result_df = df[
-            df['search_col'].apply(lambda x: all(
-                keyword in x for keyword in keywords))
-        ]
+        # Búsqueda con el índice invertido: se intersectan las descripciones
+        # únicas que contienen cada palabra clave y el resultado se expande a
+        # todas las filas mediante los índices del diccionario.
+        # Empezamos por la palabra más larga (normalmente la más selectiva) para
+        # cortar antes si ya no quedan candidatos.
+        keywords.sort(key=len, reverse=True)
+        index = build_search_index(selected_gid, df.attrs['load_id'], df)
+        candidates = keyword_candidates(index, keywords[0])
+        for kw in keywords[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(
+                candidates, keyword_candidates(index, kw), assume_unique=True)
+        uniq_mask = np.zeros(len(index.descriptions), dtype=bool)
+        uniq_mask[candidates] = True
+        result_df = df.loc[uniq_mask[index.rows]]
 
         st.subheader(
             f"Resultados de la Búsqueda: {len(result_df)} encontrados")
 
         if not result_df.empty:
+            # Paginación: solo se muestra (y se generan códigos para) la página actual
+            total_pages = max(1, (len(result_df) + PAGE_SIZE - 1) // PAGE_SIZE)
+            page = st.number_input(
+                "Página:", min_value=1, max_value=total_pages, value=1, step=1,
+                help=f"Se muestran {PAGE_SIZE} resultados por página ({total_pages} páginas en total).")
+            view = result_df.iloc[(page - 1) * PAGE_SIZE: page * PAGE_SIZE]
+            # Renombramos las columnas con espacios o '#' para poder usarlas como atributos
+            view = view.rename(
+                columns={'Folio Rebuss': 'FolioRebuss', 'ABSER#': 'ABSER'})
+
             # Iteramos sobre los resultados para mostrarlos individualmente con su código de barras
-            for index, row in result_df.iterrows():
+            for row in view.itertuples():
                 # Usamos un expander para mostrar cada resultado de forma ordenada
                 # Se actualiza el encabezado del expander para incluir PLDESC
-                with st.expander(f"Folio: {row['Folio Rebuss']} - {row['PLDESC']}"):
+                with st.expander(f"Folio: {row.FolioRebuss} - {row.PLDESC}"):
                     # Dividimos en dos columnas para datos y barcode
                     col1, col2 = st.columns([2, 1])
 
                     with col1:
-                        st.markdown(f"**Folio Rebuss:** {row['Folio Rebuss']}")
-                        # Se muestra también dentro del expander
-                        st.markdown(f"**PLDESC:** {row['PLDESC']}")
-                        st.markdown(f"**ABASSU:** {row['ABASSU']}")
-                        st.markdown(f"**ABSER#:** {row['ABSER#']}")
+                        # Un solo 'st.markdown' por resultado (un mensaje al navegador en vez de cinco)
                         st.markdown(
-                            f"**Descripción (ABDESC):** {row['ABDESC']}")
+                            f"**Folio Rebuss:** {row.FolioRebuss}\n\n"
+                            f"**PLDESC:** {row.PLDESC}\n\n"
+                            f"**ABASSU:** {row.ABASSU}\n\n"
+                            f"**ABSER#:** {row.ABSER}\n\n"
+                            f"**Descripción (ABDESC):** {row.ABDESC}")
 
                     with col2:
-                        # Generar y mostrar el código de barras
-                        barcode_image = generate_barcode(row['Folio Rebuss'])
-                        if barcode_image:
-                            # Se actualiza use_column_width a use_container_width según la advertencia
-                            st.image(
-                                barcode_image, caption=f"Código para {row['Folio Rebuss']}", use_container_width=True)
+                        if not st.session_state.get(f'open_{row.FolioRebuss}'):
+                            # El código se genera recién cuando se pide
+                            st.button("Mostrar código", key=f"show_{row.Index}",
+                                      on_click=show_barcode, args=(row.FolioRebuss,))
                         else:
-                            st.warning(
-                                "No se pudo generar el código de barras.")
+                            barcode_image = generate_barcode(row.FolioRebuss)
+                            if barcode_image:
+                                st.markdown(
+                                    f'<div style="width:100%">{barcode_image}</div>',
+                                    unsafe_allow_html=True)
+                                st.caption(f"Código para {row.FolioRebuss}")
+                            else:
+                                st.warning(
+                                    "No se pudo generar el código de barras.")
 
         else:
             st.warning("No se encontraron resultados para tu búsqueda.")
+    elif search_query.strip():
+        st.info(
+            f"Escribe al menos {MIN_QUERY_LENGTH} caracteres para buscar.")
     else:
         st.info("Esperando una consulta para mostrar los resultados.")
 else: